@@ -1,20 +1,106 @@
+import asyncio
+import errno
 import logging
-import codecs
+import os
+import socket
+import sys
 
 from knxmap.bus.tunnel import KnxTunnelConnection
 from knxmap.data.constants import *
-from knxmap.messages import parse_message, KnxConnectRequest, KnxConnectResponse, \
-                            KnxTunnellingRequest, KnxTunnellingAck, KnxConnectionStateResponse, \
-                            KnxDisconnectRequest, KnxDisconnectResponse
+from knxmap.misc import TRACE_LOG_LEVEL
+from knxmap.messages import parse_messages, KnxConnectRequest, KnxConnectResponse, \
+                            KnxTunnellingRequest, KnxTunnellingAck, KnxDisconnectRequest, \
+                            KnxDisconnectResponse
 
 LOGGER = logging.getLogger(__name__)
 
 
+# The recvmmsg(2) binding is looked up on first use, see _load_recvmmsg()
+_RECVMMSG = None
+
+
+def _load_recvmmsg():
+    """Bind recvmmsg(2) via ctypes. It receives multiple datagrams
+    with a single syscall, but it is only available on Linux. Returns
+    a (recvmmsg, iovec, mmsghdr) tuple or None if it is not available."""
+    global _RECVMMSG
+    if _RECVMMSG is not None:
+        return _RECVMMSG or None
+    _RECVMMSG = ()
+    if not sys.platform.startswith('linux'):
+        return None
+    import ctypes
+    import ctypes.util
+
+    class Iovec(ctypes.Structure):
+        _fields_ = [('iov_base', ctypes.c_void_p),
+                    ('iov_len', ctypes.c_size_t)]
+
+    class Msghdr(ctypes.Structure):
+        _fields_ = [('msg_name', ctypes.c_void_p),
+                    ('msg_namelen', ctypes.c_uint32),
+                    ('msg_iov', ctypes.POINTER(Iovec)),
+                    ('msg_iovlen', ctypes.c_size_t),
+                    ('msg_control', ctypes.c_void_p),
+                    ('msg_controllen', ctypes.c_size_t),
+                    ('msg_flags', ctypes.c_int)]
+
+    class Mmsghdr(ctypes.Structure):
+        _fields_ = [('msg_hdr', Msghdr),
+                    ('msg_len', ctypes.c_uint)]
+
+    try:
+        recvmmsg = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).recvmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(Mmsghdr), ctypes.c_uint,
+                         ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    _RECVMMSG = (recvmmsg, Iovec, Mmsghdr)
+    return _RECVMMSG
+
+
+# Requested SO_RCVBUF size of monitor sockets (capped by net.core.rmem_max)
+MONITOR_RCVBUF = 1 << 20
+# cEMI message codes of tunnelling requests that have to be acked
+_ACKABLE_MSG_CODES = frozenset(code for code, name in CEMI_PRIMITIVES.items()
+                               if name in ('L_Data.con', 'L_Data.ind', 'L_Busmon.ind'))
+# Log formats for the monitoring modes, the arguments
+# are only substituted if the record will be emitted.
+_GROUP_FMT = ('[ chan_id: %s, seq_no: %s, message_code: %s, source_addr: %s, '
+              'dest_addr: %s, tpci_type: %s, tpci_seq: %s, apci_type: %s, apci_data: %s ]')
+_BUS_FMT = '[ chan_id: %s, seq_no: %s, message_code: %s, timestamp: %s, raw_frame: %s ]'
+
+
 class KnxBusMonitor(KnxTunnelConnection):
     """Implementation of bus_monitor_mode and group_monitor_mode."""
-    def __init__(self, future, loop=None, group_monitor=True):
+    def __init__(self, future, loop=None, group_monitor=True, sock=None):
         super(KnxBusMonitor, self).__init__(future, loop=loop)
         self.group_monitor = group_monitor
+        # The socket of the transport, connected to the gateway. The peer
+        # does not change during a monitor session, so acks are written to
+        # it directly instead of going through transport.sendto(). Only
+        # the batch backend passes it in, otherwise acks go via the transport.
+        self._sock = sock
+        # Preallocated TUNNELLING_ACK frame, only the channel
+        # and sequence counter are patched for each ack.
+        self._ack_buf = KnxTunnellingAck(communication_channel=0).get_message()
+        # Handlers for incoming messages, looked up by message type
+        self._dispatch = {
+            KnxConnectResponse: self._on_connect_response,
+            KnxTunnellingRequest: self._on_tunnelling_request,
+            KnxTunnellingAck: self.print_message,
+            KnxDisconnectRequest: self._on_disconnect_request,
+            KnxDisconnectResponse: self._on_disconnect_response}
+        # Bus monitor messages are hex encoded and logged by
+        # _log_worker() instead of inside datagram_received().
+        self._log_q = asyncio.Queue(maxsize=4096)
+        self._log_task = None
+        # Number of messages dropped because the queue was full
+        self._log_dropped = 0
+        # Loop time and timer handle of the next CONNECTIONSTATE_REQUEST
+        self._next_keep_alive = None
+        self._keep_alive_handle = None
 
     def connection_made(self, transport):
         self.transport = transport
@@ -30,89 +116,310 @@ class KnxBusMonitor(KnxTunnelConnection):
         LOGGER.trace_outgoing(connect_request)
         self.transport.sendto(connect_request.get_message())
         # Send CONNECTIONSTATE_REQUEST to keep the connection alive
-        self.loop.call_later(50, self.knx_keep_alive)
+        self._next_keep_alive = self.loop.time() + 50
+        self._keep_alive_handle = self.loop.call_at(self._next_keep_alive,
+                                                    self._keep_alive)
+        if not self.group_monitor:
+            self._log_task = self.loop.create_task(self._log_worker())
+
+    def connection_lost(self, exc):
+        if self._log_task:
+            self._flush_log_q()
+            self._log_task.cancel()
+            self._log_task = None
+        if self._keep_alive_handle:
+            self._keep_alive_handle.cancel()
+            self._keep_alive_handle = None
 
     def datagram_received(self, data, addr):
-        knx_message = parse_message(data)
-        if not knx_message:
-            LOGGER.error('Invalid KNX message: {}'.format(data))
-            self.knx_tunnel_disconnect()
-            self.transport.close()
-            self.future.set_result(None)
-            return
-        knx_message.set_peer(addr)
-        LOGGER.trace_incoming(knx_message)
-        if isinstance(knx_message, KnxConnectResponse):
-            if not knx_message.ERROR:
-                if not self.tunnel_established:
-                    self.tunnel_established = True
-                self.communication_channel = knx_message.communication_channel
-            else:
-                if not self.group_monitor and knx_message.ERROR_CODE == 0x23:
-                    LOGGER.error('Device does not support BUSMONITOR, try --group-monitor instead')
-                else:
-                    LOGGER.error('Connection setup error: {}'.format(knx_message.ERROR))
+        # Parse on a memoryview so that slicing the
+        # frame does not copy it over and over again.
+        for knx_message in parse_messages(memoryview(data)):
+            if not knx_message:
+                LOGGER.error('Invalid KNX message: {}'.format(bytes(data)))
+                self.knx_tunnel_disconnect()
                 self.transport.close()
+                if not self.future.done():
+                    self.future.set_result(None)
+                return
+            knx_message.set_peer(addr)
+            LOGGER.trace_incoming(knx_message)
+            handler = self._dispatch.get(type(knx_message))
+            if handler:
+                handler(knx_message)
+            if self.future.done():
+                # The connection has been closed by a handler
+                return
+
+    def _on_connect_response(self, knx_message):
+        if not knx_message.ERROR:
+            if not self.tunnel_established:
+                self.tunnel_established = True
+            self.communication_channel = knx_message.communication_channel
+        else:
+            if not self.group_monitor and knx_message.ERROR_CODE == 0x23:
+                LOGGER.error('Device does not support BUSMONITOR, try --group-monitor instead')
+            else:
+                LOGGER.error('Connection setup error: {}'.format(knx_message.ERROR))
+            self.transport.close()
+            if not self.future.done():
                 self.future.set_result(None)
-        elif isinstance(knx_message, KnxTunnellingRequest):
-            self.print_message(knx_message)
-            if CEMI_PRIMITIVES[knx_message.cemi.message_code] == 'L_Data.con' or \
-                    CEMI_PRIMITIVES[knx_message.cemi.message_code] == 'L_Data.ind' or \
-                    CEMI_PRIMITIVES[knx_message.cemi.message_code] == 'L_Busmon.ind':
-                tunnelling_ack = KnxTunnellingAck(
+
+    def _on_tunnelling_request(self, knx_message):
+        self.print_message(knx_message)
+        if knx_message.cemi.message_code in _ACKABLE_MSG_CODES:
+            KnxTunnellingAck.write_into(self._ack_buf,
+                                        knx_message.communication_channel,
+                                        knx_message.sequence_counter)
+            if LOGGER.isEnabledFor(TRACE_LOG_LEVEL):
+                # Only build a labelled message if it will be traced
+                LOGGER.trace_outgoing(KnxTunnellingAck(
                     communication_channel=knx_message.communication_channel,
-                    sequence_count=knx_message.sequence_counter)
-                LOGGER.trace_outgoing(tunnelling_ack)
-                self.transport.sendto(tunnelling_ack.get_message())
-        elif isinstance(knx_message, KnxTunnellingAck):
-            self.print_message(knx_message)
-        elif isinstance(knx_message, KnxConnectionStateResponse):
-            # After receiving a CONNECTIONSTATE_RESPONSE schedule the next one
-            self.loop.call_later(50, self.knx_keep_alive)
-        elif isinstance(knx_message, KnxDisconnectRequest):
-            connect_response = KnxDisconnectResponse(communication_channel=self.communication_channel)
-            self.transport.sendto(connect_response.get_message())
-            self.transport.close()
+                    sequence_count=knx_message.sequence_counter))
+            self._send_ack()
+
+    def _send_ack(self):
+        # send()/sendto() copy the data, so the buffer can be reused
+        if self._sock is not None:
+            try:
+                self._sock.send(self._ack_buf)
+                return
+            except OSError:
+                # Let the transport buffer the ack or report the error
+                pass
+        self.transport.sendto(self._ack_buf)
+
+    def _keep_alive(self):
+        """Send a CONNECTIONSTATE_REQUEST and schedule the next one 50
+        seconds after the previous deadline, so that the round trip
+        time of the responses does not add up."""
+        self.knx_keep_alive()
+        now = self.loop.time()
+        self._next_keep_alive += 50
+        if self._next_keep_alive <= now:
+            # The deadline has been missed (e.g. the loop was
+            # blocked), start over from the current time.
+            self._next_keep_alive = now + 50
+        self._keep_alive_handle = self.loop.call_at(self._next_keep_alive,
+                                                    self._keep_alive)
+
+    def _on_disconnect_request(self, knx_message):
+        connect_response = KnxDisconnectResponse(communication_channel=self.communication_channel)
+        self.transport.sendto(connect_response.get_message())
+        self.transport.close()
+        if not self.future.done():
             self.future.set_result(None)
-        elif isinstance(knx_message, KnxDisconnectResponse):
-            self.transport.close()
+
+    def _on_disconnect_response(self, knx_message):
+        self.transport.close()
+        if not self.future.done():
             self.future.set_result(None)
 
     def print_message(self, message):
         """A generic message printing function. It defines
         a format for the monitoring modes."""
         assert isinstance(message, KnxTunnellingRequest)
-        cemi = tpci = apci= {}
-        if message.cemi:
-            cemi = message.cemi
-            if cemi.tpci:
-                tpci = cemi.tpci
-                if cemi.apci:
-                    apci = cemi.apci
-        if cemi.knx_destination and cemi.extended_control_field and \
-                cemi.extended_control_field.get('address_type'):
-            dst_addr = message.parse_knx_group_address(cemi.knx_destination)
-        elif cemi.knx_destination:
-            dst_addr = message.parse_knx_address(cemi.knx_destination)
+        if not LOGGER.isEnabledFor(logging.INFO):
+            return
+        # A KnxTunnellingRequest always carries a cEMI frame,
+        # TPCI and APCI are only present for data frames.
+        cemi = message.cemi
         if self.group_monitor:
-            format = ('[ chan_id: {chan_id}, seq_no: {seq_no}, message_code: {msg_code}, '
-                      'source_addr: {src_addr}, dest_addr: {dst_addr}, tpci_type: {tpci_type}, '
-                      'tpci_seq: {tpci_seq}, apci_type: {apci_type}, apci_data: {apci_data} ]').format(
-                chan_id=message.communication_channel,
-                seq_no=message.sequence_counter,
-                msg_code=CEMI_PRIMITIVES.get(cemi.message_code),
-                src_addr=message.parse_knx_address(cemi.knx_source),
-                dst_addr=dst_addr,
-                tpci_type=_CEMI_TPCI_TYPES.get(tpci.tpci_type),
-                tpci_seq=tpci.sequence,
-                apci_type=_CEMI_APCI_TYPES.get(apci.apci_type),
-                apci_data=apci.apci_data)
+            tpci = cemi.tpci
+            apci = cemi.apci if tpci else None
+            parse_address = message.parse_knx_address
+            knx_destination = cemi.knx_destination
+            dst_addr = None
+            if knx_destination:
+                ecf = cemi.extended_control_field
+                if ecf and ecf.get('address_type'):
+                    dst_addr = message.parse_knx_group_address(knx_destination)
+                else:
+                    dst_addr = parse_address(knx_destination)
+            LOGGER.info(_GROUP_FMT,
+                        message.communication_channel,
+                        message.sequence_counter,
+                        CEMI_PRIMITIVES.get(cemi.message_code),
+                        parse_address(cemi.knx_source),
+                        dst_addr,
+                        _CEMI_TPCI_TYPES.get(tpci.tpci_type) if tpci else None,
+                        tpci.sequence if tpci else None,
+                        _CEMI_APCI_TYPES.get(apci.apci_type) if apci else None,
+                        apci.apci_data if apci else None)
+        else:
+            entry = (message.communication_channel,
+                     message.sequence_counter,
+                     cemi.message_code,
+                     bytes(cemi.additional_information.get('timestamp')),
+                     bytes(cemi.raw_frame))
+            try:
+                self._log_q.put_nowait(entry)
+            except asyncio.QueueFull:
+                # Logging it right away would print it ahead of
+                # the queued messages, so the message is dropped.
+                self._log_dropped += 1
+
+    @asyncio.coroutine
+    def _log_worker(self):
+        try:
+            while True:
+                entry = yield from self._log_q.get()
+                self._log_bus_message(*entry)
+        finally:
+            # The task is also cancelled directly on Ctrl-C,
+            # log everything that has not been logged yet.
+            self._flush_log_q()
+
+    def _flush_log_q(self):
+        while not self._log_q.empty():
+            self._log_bus_message(*self._log_q.get_nowait())
+        if self._log_dropped:
+            LOGGER.warning('Dropped {} bus monitor messages, logging could not '
+                           'keep up'.format(self._log_dropped))
+            self._log_dropped = 0
+
+    @staticmethod
+    def _log_bus_message(chan_id, seq_no, message_code, timestamp, raw_frame):
+        LOGGER.info(_BUS_FMT,
+                    chan_id,
+                    seq_no,
+                    CEMI_PRIMITIVES.get(message_code),
+                    timestamp.hex(),
+                    raw_frame.hex())
+
+
+class KnxBatchedDatagramTransport(asyncio.DatagramTransport):
+    """A minimal datagram transport for the bus monitor that drains
+    all pending datagrams from the socket on every wakeup of the
+    event loop. Incoming data is received into a ring of preallocated
+    buffers, so no receive buffer is allocated per packet. On Linux
+    the whole batch is received with a single recvmmsg(2) call.
+
+    The protocol receives memoryview slices of the ring buffers. They
+    are only valid for the duration of datagram_received()."""
+    def __init__(self, loop, sock, protocol, batch_size=64, buffer_size=512):
+        super(KnxBatchedDatagramTransport, self).__init__(extra={
+            'socket': sock,
+            'peername': sock.getpeername(),
+            'sockname': sock.getsockname()})
+        self._loop = loop
+        self._sock = sock
+        self._protocol = protocol
+        self._closing = False
+        self._buffers = [memoryview(bytearray(buffer_size)) for _ in range(batch_size)]
+        self._mmsgs = None
+        recvmmsg = _load_recvmmsg()
+        if recvmmsg:
+            self._setup_mmsgs(*recvmmsg)
+        self._loop.call_soon(self._protocol.connection_made, self)
+        self._loop.call_soon(self._loop.add_reader, self._sock.fileno(), self._read_ready)
+
+    def _setup_mmsgs(self, recvmmsg, iovec, mmsghdr):
+        """Point one mmsghdr/iovec pair at each of the ring buffers."""
+        import ctypes
+        self._recvmmsg = recvmmsg
+        self._iovecs = (iovec * len(self._buffers))()
+        self._mmsgs = (mmsghdr * len(self._buffers))()
+        # Keep the ctypes views alive, they reference the ring buffers
+        self._c_buffers = []
+        for i, buf in enumerate(self._buffers):
+            c_buf = (ctypes.c_char * len(buf)).from_buffer(buf)
+            self._c_buffers.append(c_buf)
+            self._iovecs[i].iov_base = ctypes.addressof(c_buf)
+            self._iovecs[i].iov_len = len(buf)
+            self._mmsgs[i].msg_hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            self._mmsgs[i].msg_hdr.msg_iovlen = 1
+
+    def _recv_batch_mmsg(self):
+        count = self._recvmmsg(self._sock.fileno(), self._mmsgs, len(self._buffers),
+                               socket.MSG_DONTWAIT, None)
+        if count < 0:
+            import ctypes
+            err = ctypes.get_errno()
+            if err not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                self._protocol.error_received(OSError(err, os.strerror(err)))
+            return []
+        # The socket is connected, all datagrams come from the gateway
+        addr = self.get_extra_info('peername')
+        return [(self._buffers[i][:self._mmsgs[i].msg_len], addr) for i in range(count)]
+
+    def _recv_batch(self):
+        batch = []
+        for buf in self._buffers:
+            try:
+                nbytes, addr = self._sock.recvfrom_into(buf)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                self._protocol.error_received(e)
+                break
+            batch.append((buf[:nbytes], addr))
+        return batch
+
+    def _read_ready(self):
+        if self._mmsgs is not None:
+            batch = self._recv_batch_mmsg()
         else:
-            format = ('[ chan_id: {chan_id}, seq_no: {seq_no}, message_code: {msg_code}, '
-                      'timestamp: {timestamp}, raw_frame: {raw_frame} ]').format(
-                chan_id=message.communication_channel,
-                seq_no=message.sequence_counter,
-                msg_code=CEMI_PRIMITIVES.get(cemi.message_code),
-                timestamp=codecs.encode(cemi.additional_information.get('timestamp'), 'hex'),
-                raw_frame=codecs.encode(cemi.raw_frame, 'hex'))
-        LOGGER.info(format)
+            batch = self._recv_batch()
+        for data, addr in batch:
+            if self._closing:
+                break
+            self._protocol.datagram_received(data, addr)
+
+    def sendto(self, data, addr=None):
+        if self._closing:
+            return
+        try:
+            self._sock.send(data)
+        except OSError as e:
+            self._protocol.error_received(e)
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._sock.fileno())
+        self._loop.call_soon(self._call_connection_lost)
+
+    def abort(self):
+        self.close()
+
+    def _call_connection_lost(self):
+        try:
+            self._protocol.connection_lost(None)
+        finally:
+            self._sock.close()
+
+
+def set_monitor_rcvbuf(sock, rcvbuf=MONITOR_RCVBUF):
+    """Enlarge the receive buffer of a monitor socket so that bursts
+    of bus traffic are queued by the kernel instead of being dropped."""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    except OSError as e:
+        LOGGER.debug('Could not set receive buffer size: {}'.format(e))
+
+
+def create_monitor_socket(remote_addr, rcvbuf=MONITOR_RCVBUF):
+    """Create a non-blocking UDP socket with an enlarged receive
+    buffer that is connected to the gateway."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        set_monitor_rcvbuf(sock, rcvbuf)
+        sock.connect(remote_addr)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def create_batched_endpoint(loop, protocol_factory, sock):
+    """Counterpart of loop.create_datagram_endpoint(sock=sock) that
+    uses a KnxBatchedDatagramTransport for the connection."""
+    protocol = protocol_factory()
+    transport = KnxBatchedDatagramTransport(loop, sock, protocol)
+    return transport, protocol
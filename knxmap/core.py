@@ -22,7 +22,8 @@ from knxmap.targets import *
 from knxmap.exceptions import *
 from knxmap.bus.tunnel import KnxTunnelConnection
 from knxmap.bus.router import KnxRoutingConnection
-from knxmap.bus.monitor import KnxBusMonitor
+from knxmap.bus.monitor import KnxBusMonitor, create_batched_endpoint, create_monitor_socket, \
+                            set_monitor_rcvbuf
 
 LOGGER = logging.getLogger(__name__)
 
@@ -243,7 +244,7 @@ class KnxMap(object):
             pass
 
     @asyncio.coroutine
-    def monitor(self, targets=None, group_monitor_mode=False):
+    def monitor(self, targets=None, group_monitor_mode=False, backend='asyncio'):
         if targets:
             self.set_targets(targets)
         if group_monitor_mode:
@@ -251,9 +252,20 @@ class KnxMap(object):
         else:
             LOGGER.debug('Starting bus monitor')
         future = asyncio.Future()
-        transport, protocol = yield from self.loop.create_datagram_endpoint(
-            functools.partial(KnxBusMonitor, future, group_monitor=group_monitor_mode),
-            remote_addr=list(self.targets)[0])
+        if backend == 'batch':
+            sock = create_monitor_socket(list(self.targets)[0])
+            transport, protocol = create_batched_endpoint(
+                self.loop,
+                functools.partial(KnxBusMonitor, future,
+                                  group_monitor=group_monitor_mode, sock=sock),
+                sock)
+        else:
+            # Passing a connected socket via sock= does not work before
+            # Python 3.7, the transport would send to a None address.
+            transport, protocol = yield from self.loop.create_datagram_endpoint(
+                functools.partial(KnxBusMonitor, future, group_monitor=group_monitor_mode),
+                remote_addr=list(self.targets)[0])
+            set_monitor_rcvbuf(transport.get_extra_info('socket'))
         self.bus_protocols.append(protocol)
         yield from future
         if group_monitor_mode:
@@ -570,16 +582,16 @@ class KnxMap(object):
                 connections = len(knx_gateway.additional_individual_addresses)
             if self.max_connections and connections > self.max_connections:
                 connections = self.max_connections
-        connectors = [asyncio.Task(self._tunnel_connection(knx_gateway))
+        connectors = [self.loop.create_task(self._tunnel_connection(knx_gateway))
                       for _ in range(connections)]
         yield from asyncio.wait(connectors)
         LOGGER.info('Established %d connections to target %s' %
                     (len(self.bus_connections[knx_gateway.host]),
                      knx_gateway.host))
-        workers = [asyncio.Task(self._knx_bus_worker(c.get('transport'),
-                                                     c.get('protocol'),
-                                                     knx_gateway),
-                                loop=self.loop) for c in self.bus_connections[knx_gateway.host]]
+        workers = [self.loop.create_task(self._knx_bus_worker(c.get('transport'),
+                                                              c.get('protocol'),
+                                                              knx_gateway))
+                   for c in self.bus_connections[knx_gateway.host]]
         self.t0 = time.time()
         yield from queue.join()
         self.t1 = time.time()
@@ -613,7 +625,7 @@ class KnxMap(object):
         if targets:
             self.set_targets(targets)
         if self.medium == 'net':
-            workers = [asyncio.Task(self._knx_description_worker(), loop=self.loop)
+            workers = [self.loop.create_task(self._knx_description_worker())
                        for _ in range(self.max_workers
                                       if len(self.targets) > self.max_workers else len(self.targets))]
             self.t0 = time.time()
@@ -624,9 +636,9 @@ class KnxMap(object):
 
             if bus_targets and self.knx_gateways:
                 # Start scanning on the bus
-                bus_scanners = [asyncio.Task(self._bus_scan(knx_gateway=g,
-                                                            bus_targets=bus_targets),
-                                             loop=self.loop) for g in self.knx_gateways]
+                bus_scanners = [self.loop.create_task(self._bus_scan(knx_gateway=g,
+                                                                     bus_targets=bus_targets))
+                                for g in self.knx_gateways]
                 yield from asyncio.wait(bus_scanners)
 
             if not self.testing:
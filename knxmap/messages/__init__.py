@@ -12,11 +12,15 @@ from knxmap.messages.configuration import KnxDeviceConfigurationRequest, KnxDevi
 from knxmap.messages.core import KnxSearchRequest, KnxSearchResponse, KnxDescriptionRequest, \
     KnxDescriptionResponse, KnxConnectRequest, KnxConnectResponse, KnxConnectionStateRequest, \
     KnxConnectionStateResponse, KnxDisconnectRequest, KnxDisconnectResponse
-from knxmap.messages.tunnelling import KnxTunnellingRequest, KnxTunnellingAck
+from knxmap.messages.tunnelling import KnxTunnellingRequest, KnxTunnellingAck, fast_parse_tunnelling
 from knxmap.messages.routing import KnxRoutingIndication, KnxRoutingLostMessage, KnxRoutingBusy
 from knxmap.messages.remconf import KnxRemoteDiagnosticRequest, KnxRemoteDiagnosticResponse
 
 LOGGER = logging.getLogger(__name__)
+_TUNNELLING_REQUEST = KNX_MESSAGE_TYPES.get('TUNNELLING_REQUEST')
+_HEADER_PREFIX_STRUCT = struct.Struct('>BBH')
+# service_type and total_length of the KNXnet/IP header
+_SERVICE_STRUCT = struct.Struct('>HH')
 
 
 def parse_message(data):
@@ -24,11 +28,11 @@ def parse_message(data):
     Determines the message type of data and returns a corresponding class instance. This is a helper
     function for data that has been received from a KNXnet/IP gateway.
 
-    :param data: Incoming data from a KNXnet/IP gateway.
+    :param data: Incoming data from a KNXnet/IP gateway (bytes-like, e.g. a memoryview).
     :return: A class instance of any KnxMessage subclass or None if data is not a valid KNX message.
     """
     try:
-        _, _, message_type = struct.unpack('>BBH', data[:4])
+        _, _, message_type = _HEADER_PREFIX_STRUCT.unpack_from(data)
         message_type = int(message_type)
     except struct.error as e:
         LOGGER.exception(e)
@@ -72,4 +76,38 @@ def parse_message(data):
         return KnxDeviceConfigurationAck(data)
     else:
         LOGGER.error('Unknown message type: {}'.format(message_type))
-        return None
\ No newline at end of file
+        return None
+
+
+def parse_messages(data):
+    """
+    Like parse_message(), but for data that may contain multiple KNXnet/IP frames back to back
+    in a single datagram. The frames are split according to the total_length header field.
+    TUNNELLING_REQUESTs, which make up most of the traffic when monitoring, are handled by
+    the specialized fast_parse_tunnelling().
+
+    Trailing bytes that do not hold a complete frame (e.g. padding) are dropped.
+
+    :param data: Incoming data from a KNXnet/IP gateway (bytes-like, e.g. a memoryview).
+    :return: A generator that yields a parsed message (or None) for each frame.
+    """
+    offset = 0
+    length = len(data)
+    while offset < length:
+        try:
+            service_type, total_length = _SERVICE_STRUCT.unpack_from(data, offset + 2)
+        except struct.error:
+            service_type, total_length = None, 0
+        if total_length < 6 or offset + total_length > length:
+            if offset:
+                LOGGER.debug('Ignoring {} trailing bytes: {}'.format(
+                    length - offset, bytes(data[offset:])))
+                return
+            # Inconsistent length field, let parse_message() handle it
+            service_type, total_length = None, length
+        frame = data[offset:offset + total_length]
+        if service_type == _TUNNELLING_REQUEST:
+            yield fast_parse_tunnelling(frame)
+        else:
+            yield parse_message(frame)
+        offset += total_length
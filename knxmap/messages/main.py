@@ -1,4 +1,5 @@
 import collections
+import functools
 import logging
 import socket
 import struct
@@ -8,6 +9,20 @@ from knxmap import KNX_CONSTANTS
 from .cemi import CemiFrame
 
 LOGGER = logging.getLogger(__name__)
+# The KNXnet/IP header is packed/unpacked for each message
+_HEADER_STRUCT = struct.Struct('!BBHH')
+
+
+# Formatted addresses are cached because the same few
+# addresses show up over and over again (e.g. in monitor mode).
+@functools.lru_cache(maxsize=65536)
+def _format_knx_address(address):
+    return '{}.{}.{}'.format((address >> 12) & 0xf, (address >> 8) & 0xf, address & 0xff)
+
+
+@functools.lru_cache(maxsize=65536)
+def _format_knx_group_address(address):
+    return '{}/{}/{}'.format((address >> 11) & 0x1f, (address >> 8) & 0x7, address & 0xff)
 
 
 class KnxMessage(object):
@@ -51,7 +66,7 @@ class KnxMessage(object):
         '8.6.159'
         """
         assert isinstance(address, int), 'Address should be an integer'
-        return '{}.{}.{}'.format((address >> 12) & 0xf, (address >> 8) & 0xf, address & 0xff)
+        return _format_knx_address(address & 0xffff)
 
     @staticmethod
     def pack_knx_address(address):
@@ -72,7 +87,7 @@ class KnxMessage(object):
         '6/0/57'
         """
         assert isinstance(address, int), 'Address should be an integer'
-        return '{}/{}/{}'.format((address >> 11) & 0x1f, (address >> 8) & 0x7, address & 0xff)
+        return _format_knx_group_address(address & 0xffff)
 
     @staticmethod
     def pack_knx_group_address(address):
@@ -163,11 +178,11 @@ class KnxMessage(object):
 
     def _pack_knx_header(self):
         try:
-            return bytearray(struct.pack('!BBHH',
-                               self.header.get('header_length'),
-                               self.header.get('protocol_version'),
-                               self.header.get('service_type'),
-                               self.header.get('total_length')))
+            return bytearray(_HEADER_STRUCT.pack(
+                self.header.get('header_length'),
+                self.header.get('protocol_version'),
+                self.header.get('service_type'),
+                self.header.get('total_length')))
         except struct.error as e:
             LOGGER.exception(e)
 
@@ -177,7 +192,7 @@ class KnxMessage(object):
             self.header['header_length'], \
             self.header['protocol_version'], \
             self.header['service_type'], \
-            self.header['total_length'] = struct.unpack('!BBHH', message[:6])
+            self.header['total_length'] = _HEADER_STRUCT.unpack_from(message)
             return message[6:]
         except struct.error as e:
             LOGGER.exception(e)
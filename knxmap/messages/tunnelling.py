@@ -7,8 +7,18 @@ from knxmap import KNX_MESSAGE_TYPES
 from .main import KnxMessage
 from .cemi import CemiFrame
 from .tp import ExtendedDataRequest
+from .tpci import Tpci
+from .apci import Apci
 
 LOGGER = logging.getLogger(__name__)
+# Connection header of TUNNELLING_REQUEST and TUNNELLING_ACK bodies:
+# structure_length, communication_channel, sequence_counter, reserved/status
+_CONNECTION_HEADER_STRUCT = struct.Struct('!BBBB')
+# communication_channel and sequence_counter, located at offset 7 of a frame
+_CHANNEL_SEQ_STRUCT = struct.Struct('!BB')
+# Fixed part of a cEMI L_Data frame: control field, extended control field,
+# source address, destination address, NPDU length
+_LDATA_STRUCT = struct.Struct('!BBHHB')
 
 
 class KnxTunnellingRequest(KnxMessage):
@@ -47,13 +57,12 @@ class KnxTunnellingRequest(KnxMessage):
 
     def _unpack_knx_body(self, message):
         try:
-            message = io.BytesIO(message)
-            self.structure_length = self._unpack_stream('!B', message)
-            self.communication_channel = self._unpack_stream('!B', message)
-            self.sequence_counter = self._unpack_stream('!B', message)
-            self._unpack_stream('!B', message) # reserved
+            self.structure_length, \
+            self.communication_channel, \
+            self.sequence_counter, \
+            _ = _CONNECTION_HEADER_STRUCT.unpack_from(message) # last byte is reserved
             # TODO: check what kind of data request it is?
-            self.cemi.unpack_extended_data_request(message)
+            self.cemi.unpack_extended_data_request(io.BytesIO(message[4:]))
         except Exception as e:
             LOGGER.exception(e)
 
@@ -345,12 +354,21 @@ class KnxTunnellingAck(KnxMessage):
             self.pack_knx_message()
 
     def _pack_knx_body(self):
-        self.body = bytearray(struct.pack('!B', self.structure_length))
-        self.body.extend(struct.pack('!B', self.communication_channel))
-        self.body.extend(struct.pack('!B', self.sequence_count))
-        self.body.extend(struct.pack('!B', self.status))
+        self.body = bytearray(_CONNECTION_HEADER_STRUCT.pack(
+            self.structure_length,
+            self.communication_channel,
+            self.sequence_count,
+            self.status))
         return self.body
 
+    @staticmethod
+    def write_into(buf, communication_channel, sequence_count):
+        """Patch the communication channel and sequence counter
+        of an already packed TUNNELLING_ACK frame in buf. This allows
+        to reuse a single buffer instead of creating a new message
+        for each ack."""
+        _CHANNEL_SEQ_STRUCT.pack_into(buf, 7, communication_channel, sequence_count)
+
     def _unpack_knx_body(self, message):
         try:
             message = io.BytesIO(message)
@@ -360,3 +378,47 @@ class KnxTunnellingAck(KnxMessage):
             self.status = self._unpack_stream('!B', message)
         except Exception as e:
             LOGGER.exception(e)
+
+
+def fast_parse_tunnelling(data):
+    """A specialized parser for incoming TUNNELLING_REQUESTs. It unpacks
+    the fields of cEMI L_Data frames directly from data instead of going
+    through streams and an intermediate ExtendedDataRequest. Frames it
+    can not handle are parsed by the regular KnxTunnellingRequest."""
+    try:
+        message = KnxTunnellingRequest()
+        message.message = data
+        body = message._unpack_knx_header(data)
+        message.structure_length, \
+        message.communication_channel, \
+        message.sequence_counter, \
+        _ = _CONNECTION_HEADER_STRUCT.unpack_from(body)
+        cemi = message.cemi
+        cemi.message_code = body[4]
+        cemi.additional_information_len = body[5]
+        if cemi.additional_information_len > 0:
+            # L_Busmon.ind frames are not decoded any further and the
+            # regular parser does not skip additional information of
+            # L_Data frames, leave both to it so the results match.
+            return KnxTunnellingRequest(data)
+        offset = 6
+        control_field, \
+        extended_control_field, \
+        cemi.knx_source, \
+        cemi.knx_destination, \
+        cemi.npdu_len = _LDATA_STRUCT.unpack_from(body, offset)
+        offset += _LDATA_STRUCT.size
+        tpci_apci = bytearray(body[offset:offset + cemi.npdu_len + 1])
+        if len(tpci_apci) != cemi.npdu_len + 1:
+            raise ValueError('Truncated cEMI frame')
+    except (struct.error, IndexError, TypeError, ValueError):
+        return KnxTunnellingRequest(data)
+    cemi.control_field = ExtendedDataRequest.unpack_control_field(control_field)
+    cemi.extended_control_field = ExtendedDataRequest.unpack_extended_control_field(
+        extended_control_field)
+    cemi.tpci = Tpci()
+    cemi.tpci.unpack(tpci_apci[0])
+    cemi.apci = Apci()
+    cemi.apci.unpack(tpci_apci)
+    cemi.data = tpci_apci[2:] if cemi.npdu_len > 1 else bytearray()
+    return message
@@ -21,6 +21,8 @@ setup(name='KNXmap',
       entry_points={
           'console_scripts': ['knxmap=knxmap.main:main']},
       install_requires=install_require,
+      extras_require={
+          'uvloop': ['uvloop']},
       url='https://github.com/takeshixx/knxmap',
       license='GNU GPLv3',
       author='takeshix',
@@ -0,0 +1,102 @@
+import struct
+import unittest
+
+from knxmap.messages import parse_messages, KnxTunnellingRequest, \
+    KnxConnectionStateResponse, fast_parse_tunnelling
+
+
+def tunnelling_request(sequence_counter, cemi):
+    """Build a TUNNELLING_REQUEST frame that carries cemi."""
+    body = struct.pack('!BBBB', 4, 7, sequence_counter, 0) + cemi
+    return struct.pack('!BBHH', 6, 0x10, 0x0420, 6 + len(body)) + body
+
+
+# L_Data.ind, 1.1.1 -> 1/2/3, A_GroupValue_Write with value 1
+GROUP_WRITE = bytes.fromhex('2900bce011010a03010081')
+# L_Data.ind, 1.1.1 -> 1.1.2, T_Connect (1 byte NPDU)
+TPCI_CONNECT = bytes.fromhex('2900b060110111020080')
+# L_Data.con, 1.1.1 -> 1/2/3, A_GroupValue_Write with value 1
+GROUP_WRITE_CON = bytes.fromhex('2e00bce011010a03010081')
+# L_Data.ind with 4 bytes of additional information
+GROUP_WRITE_ADD_INFO = bytes.fromhex('29040302aabbbce011010a03010081')
+# CONNECTIONSTATE_RESPONSE for channel 7
+CONNECTIONSTATE_RESPONSE = bytes.fromhex('0610020800080700')
+
+
+class ParseMessagesTests(unittest.TestCase):
+
+    def test_single_frame(self):
+        messages = list(parse_messages(tunnelling_request(0, GROUP_WRITE)))
+        self.assertEqual(len(messages), 1)
+        self.assertIsInstance(messages[0], KnxTunnellingRequest)
+
+    def test_coalesced_frames(self):
+        data = tunnelling_request(0, GROUP_WRITE) + \
+            tunnelling_request(1, GROUP_WRITE) + \
+            CONNECTIONSTATE_RESPONSE
+        messages = list(parse_messages(memoryview(data)))
+        self.assertEqual(len(messages), 3)
+        self.assertIsInstance(messages[0], KnxTunnellingRequest)
+        self.assertIsInstance(messages[1], KnxTunnellingRequest)
+        self.assertIsInstance(messages[2], KnxConnectionStateResponse)
+        self.assertEqual([m.sequence_counter for m in messages[:2]], [0, 1])
+
+    def test_padded_frame(self):
+        data = tunnelling_request(0, GROUP_WRITE) + b'\x00\x00'
+        messages = list(parse_messages(memoryview(data)))
+        self.assertEqual(len(messages), 1)
+        self.assertIsInstance(messages[0], KnxTunnellingRequest)
+        self.assertEqual(messages[0].sequence_counter, 0)
+
+    def test_truncated_trailing_frame(self):
+        data = tunnelling_request(0, GROUP_WRITE) + tunnelling_request(1, GROUP_WRITE)[:12]
+        messages = list(parse_messages(memoryview(data)))
+        self.assertEqual(len(messages), 1)
+        self.assertIsInstance(messages[0], KnxTunnellingRequest)
+
+
+class FastParseTunnellingTests(unittest.TestCase):
+
+    @staticmethod
+    def fields(message):
+        cemi = message.cemi
+        return (message.structure_length,
+                message.communication_channel,
+                message.sequence_counter,
+                cemi.message_code,
+                cemi.additional_information_len,
+                cemi.control_field,
+                cemi.extended_control_field,
+                cemi.knx_source,
+                cemi.knx_destination,
+                cemi.npdu_len,
+                vars(cemi.tpci) if cemi.tpci else None,
+                vars(cemi.apci) if cemi.apci else None,
+                getattr(cemi, 'data', None))
+
+    def assert_same_as_regular_parser(self, cemi):
+        data = tunnelling_request(3, cemi)
+        expected = self.fields(KnxTunnellingRequest(data))
+        self.assertEqual(self.fields(fast_parse_tunnelling(memoryview(data))), expected)
+        return expected
+
+    def test_group_write(self):
+        fields = self.assert_same_as_regular_parser(GROUP_WRITE)
+        self.assertEqual(fields[7:9], (0x1101, 0x0a03))
+
+    def test_one_byte_npdu(self):
+        fields = self.assert_same_as_regular_parser(TPCI_CONNECT)
+        self.assertEqual(fields[9], 0)
+
+    def test_l_data_con(self):
+        self.assert_same_as_regular_parser(GROUP_WRITE_CON)
+
+    def test_truncated(self):
+        self.assert_same_as_regular_parser(GROUP_WRITE[:-1])
+
+    def test_additional_information(self):
+        self.assert_same_as_regular_parser(GROUP_WRITE_ADD_INFO)
+
+
+if __name__ == '__main__':
+    unittest.main()